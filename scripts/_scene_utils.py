@@ -0,0 +1,131 @@
+"""
+Shared helpers for the compile_* scripts: image collection and sizing, and scene
+captions from the Chapters.md file that imaginize writes next to the generated images.
+"""
+
+import os
+import re
+import mmap
+import struct
+from functools import lru_cache
+from itertools import islice
+from pathlib import Path
+from PIL import Image
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+SCENE_RE = re.compile(r'chapter_(\d+)_scene_(\d+)')
+# Chapters.md is scanned as raw bytes, so these patterns are bytes patterns:
+# "**Visual Elements:**" plus its continuation lines (up to a blank or "**" line)
+_VISUAL_RE = re.compile(rb'\*\*Visual Elements:\*\*(.*(?:\n(?!\s*$|\*\*).*)*)', re.MULTILINE)
+_SCENE_REF_RE = re.compile(rb'chapter_(\d+)_scene_(\d+)')
+
+# Words dropped from captions unless capitalized
+_SKIP_WORDS = frozenset({'a', 'an', 'the', 'is', 'are', 'was', 'were', 'has', 'have', 'had',
+                         'and', 'or', 'but', 'with', 'by', 'for', 'to', 'from', 'of',
+                         'tall', 'short', 'out', 'shape', 'dressed', 'appearing', 'blurred',
+                         'contrasting', 'standing', 'sitting', 'looking', 'like'})
+_LOCATION_PREPS = frozenset({'in', 'at', 'on', 'near', 'before'})
+# A period that ends a word closes the first sentence
+_SENTENCE_END_RE = re.compile(r'\.(?=\s|$)')
+# A whitespace-delimited word without its trailing ",.;:" punctuation
+_WORD_RE = re.compile(r'(\S+?)[,.;:]*(?=\s|$)')
+
+def collect_images(base_dir):
+    """Collect all PNG images sorted by chapter and scene."""
+    base_path = Path(base_dir)
+
+    # os.scandir reuses the directory listing's type info instead of stat()ing each entry
+    if base_path.name.startswith('imaginize_'):
+        image_dirs = [base_path]
+    else:
+        with os.scandir(base_path) as entries:
+            image_dirs = [entry.path for entry in entries
+                          if entry.name.startswith('imaginize_') and entry.is_dir()]
+
+    images = []
+    for img_dir in image_dirs:
+        with os.scandir(img_dir) as entries:
+            images.extend(entry.path for entry in entries
+                          if entry.name.endswith('.png') and entry.is_file())
+
+    def sort_key(path):
+        filename = Path(path).stem
+        match = SCENE_RE.search(filename)
+        if match:
+            return (int(match.group(1)), int(match.group(2)))
+        return (999, 999)
+
+    images.sort(key=sort_key)
+    return images
+
+def read_image_size(img_path):
+    """Read (width, height) from the PNG IHDR chunk, falling back to Pillow for other formats."""
+    with open(img_path, 'rb') as f:
+        header = f.read(24)
+    if header[:8] == PNG_SIGNATURE and header[12:16] == b'IHDR':
+        return struct.unpack('>II', header[16:24])
+    with Image.open(img_path) as img:
+        return img.size
+
+def load_scene_descriptions(imaginize_dir):
+    """Load full scene descriptions from Chapters.md, keyed by (chapter, scene)."""
+    descriptions = {}
+    chapters_file = Path(imaginize_dir) / 'Chapters.md'
+
+    if not chapters_file.exists():
+        return descriptions
+
+    try:
+        # mmap the file and scan the bytes directly: only matched descriptions are decoded
+        with open(chapters_file, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return descriptions
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as content:
+                # One pass over the file: each Visual Elements block is paired with the
+                # first image reference that appears before the next block starts
+                for match in _VISUAL_RE.finditer(content):
+                    block_end = content.find(b'**Visual Elements:**', match.end())
+                    if block_end == -1:
+                        block_end = len(content)
+                    ref = _SCENE_REF_RE.search(content, match.start(), block_end)
+                    if ref:
+                        key = (ref.group(1).decode('ascii'), ref.group(2).decode('ascii'))
+                        descriptions[key] = ' '.join(match.group(1).decode('utf-8').split())
+
+    except Exception as e:
+        print(f"⚠️  Warning: Could not parse Chapters.md: {e}")
+
+    return descriptions
+
+@lru_cache(maxsize=None)
+def extract_smart_caption(desc):
+    """Extract a concise caption (5-8 words) focusing on subject and location."""
+    if not desc:
+        return ""
+
+    # Capture first sentence only (up to the first word ending in a period)
+    end = _SENTENCE_END_RE.search(desc)
+    words = (m.group(1) for m in _WORD_RE.finditer(desc, 0, end.start() if end else len(desc)))
+
+    # Build caption from key words, preserving proper nouns and location prepositions;
+    # tokenizing is lazy, so it stops as soon as seven words are kept
+    result = list(islice((word for word in words
+                          if word[0].isupper() or word.lower() in _LOCATION_PREPS
+                          or (word.lower() not in _SKIP_WORDS and len(word) > 2)), 7))
+
+    return ' '.join(result) if result else desc[:50]
+
+def get_caption(img_path, descriptions, default=None):
+    """Get concise caption for image from descriptions.
+
+    Images whose name has no chapter/scene fall back to `default`, or to the
+    file stem when no default is given.
+    """
+    filename = Path(img_path).stem
+    match = SCENE_RE.search(filename)
+    if match:
+        chapter, scene = match.group(1), match.group(2)
+        if (chapter, scene) in descriptions:
+            return extract_smart_caption(descriptions[(chapter, scene)])
+        return f"Chapter {chapter}, Scene {scene}"
+    return filename if default is None else default
@@ -2,18 +2,42 @@
 """
 Compile images into a CBZ (Comic Book Zip) archive with metadata pages.
 CBZ is a widely supported format for comic readers.
+
+Requires Pillow. Pillow-SIMD (`pip install pillow-simd`, needs an AVX2 CPU) is a
+drop-in replacement that speeds up the convert/draw/PNG-encode work done per
+image in add_caption_overlay; no code changes are needed to use it.
+
+If pyvips (libvips) is installed, captioned pages are composited and re-encoded
+with it instead, which is considerably faster than Pillow's decode/encode.
 """
 
+import io
 import os
 import sys
 import json
+import time
 import zipfile
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 from PIL import Image, ImageDraw, ImageFont
-import re
 
+from _scene_utils import SCENE_RE, collect_images, load_scene_descriptions, get_caption
+
+try:
+    import pyvips
+except ImportError:
+    pyvips = None
+
+CAPTION_HEIGHT = 80
+
+@lru_cache(maxsize=16)
 def get_font(size, bold=False):
-    """Get a font, falling back to default if custom fonts unavailable."""
+    """Get a font, falling back to default if custom fonts unavailable.
+
+    Cached so each (size, bold) face is loaded once per process and its
+    FreeType glyph cache stays warm across pages and caption overlays.
+    """
     font_paths = [
         "/system/fonts/Roboto-Bold.ttf" if bold else "/system/fonts/Roboto-Regular.ttf",
         "/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf" if bold else "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
@@ -25,124 +49,14 @@ def get_font(size, bold=False):
             continue
     return ImageFont.load_default()
 
-def load_scene_descriptions(imaginize_dir):
-    """Load full scene descriptions from Chapters.md file."""
-    descriptions = {}
-    chapters_file = Path(imaginize_dir) / 'Chapters.md'
-
-    if not chapters_file.exists():
-        return descriptions
-
-    try:
-        with open(chapters_file, 'r', encoding='utf-8') as f:
-            content = f.read()
-
-        lines = content.split('\n')
-        i = 0
-
-        while i < len(lines):
-            line = lines[i].strip()
-
-            if '**Visual Elements:**' in line:
-                desc_line = line.split('**Visual Elements:**', 1)[1].strip()
-                full_desc = desc_line
-                k = i + 1
-                while k < len(lines) and lines[k].strip() and not lines[k].startswith('**'):
-                    full_desc += ' ' + lines[k].strip()
-                    k += 1
-
-                # Look for the image reference
-                for j in range(i, min(i+15, len(lines))):
-                    if 'chapter_' in lines[j] and '_scene_' in lines[j]:
-                        match = re.search(r'chapter_(\d+)_scene_(\d+)', lines[j])
-                        if match:
-                            descriptions[(match.group(1), match.group(2))] = full_desc.strip()
-                        break
-            i += 1
-
-        print(f"✅ Loaded {len(descriptions)} scene descriptions")
-
-    except Exception as e:
-        print(f"⚠️  Warning: Could not parse Chapters.md: {e}")
-
-    return descriptions
-
-def extract_smart_caption(desc):
-    """Extract a concise caption (5-8 words) focusing on subject and location."""
-    if not desc:
-        return ""
-
-    words = desc.split()
-    result = []
-
-    # Words to skip entirely
-    skip = {'a', 'an', 'the', 'is', 'are', 'was', 'were', 'has', 'have', 'had',
-            'and', 'or', 'but', 'with', 'by', 'for', 'to', 'from', 'of',
-            'tall', 'short', 'out', 'shape', 'dressed', 'appearing', 'blurred',
-            'contrasting', 'standing', 'sitting', 'looking', 'like'}
-
-    # Capture first sentence only (before first period)
-    first_sentence = []
-    for w in words:
-        first_sentence.append(w)
-        if w.endswith('.'):
-            break
-
-    # Build caption from key words, preserving proper nouns
-    for word in first_sentence:
-        clean = word.rstrip(',.;:')
-        if not clean:
-            continue
-
-        # Always keep capitalized words (proper nouns) and location prepositions
-        if clean[0].isupper() or clean.lower() in ['in', 'at', 'on', 'near', 'before']:
-            result.append(clean)
-        elif clean.lower() not in skip and len(clean) > 2:
-            result.append(clean)
-
-        if len(result) >= 7:
-            break
-
-    return ' '.join(result) if result else desc[:50]
-
-def get_caption(img_path, descriptions):
-    """Get concise caption for image."""
-    filename = Path(img_path).stem
-    match = re.search(r'chapter_(\d+)_scene_(\d+)', filename)
-    if match:
-        chapter, scene = match.group(1), match.group(2)
-        if (chapter, scene) in descriptions:
-            return extract_smart_caption(descriptions[(chapter, scene)])
-        return f"Chapter {chapter}, Scene {scene}"
-    return Path(img_path).stem
-
-def collect_images(base_dir):
-    """Collect all PNG images sorted by chapter and scene."""
-    images = []
-    base_path = Path(base_dir)
-
-    if base_path.name.startswith('imaginize_'):
-        for img_file in base_path.glob('*.png'):
-            images.append(str(img_file))
-    else:
-        for img_dir in base_path.glob('imaginize_*'):
-            if img_dir.is_dir():
-                for img_file in img_dir.glob('*.png'):
-                    images.append(str(img_file))
-
-    def sort_key(path):
-        filename = Path(path).stem
-        match = re.search(r'chapter_(\d+)_scene_(\d+)', filename)
-        if match:
-            return (int(match.group(1)), int(match.group(2)))
-        return (999, 999)
-
-    images.sort(key=sort_key)
-    return images
+@lru_cache(maxsize=4)
+def page_template(width, height, bg_color):
+    """Blank page background, built once per size and color."""
+    return Image.new('RGB', (width, height), color=bg_color)
 
 def create_page_image(width, height, bg_color='#1a1a1a'):
     """Create a blank page image with dark background."""
-    return Image.new('RGB', (width, height), color=bg_color)
+    return page_template(width, height, bg_color).copy()
 
 def create_title_page(title, author, width=1024, height=1024):
     """Create title/cover page."""
@@ -188,7 +102,7 @@ def create_metadata_page(title, author, num_images, width=1024, height=1024):
 
     return img
 
-def create_toc_page(images, descriptions, width=1024, height=1024):
+def create_toc_page(images, captions, width=1024, height=1024):
     """Create table of contents page."""
     img = create_page_image(width, height)
     draw = ImageDraw.Draw(img)
@@ -203,12 +117,13 @@ def create_toc_page(images, descriptions, width=1024, height=1024):
 
     for i, img_path in enumerate(images[:max_items]):
         filename = Path(img_path).stem
-        match = re.search(r'chapter_(\d+)_scene_(\d+)', filename)
+        match = SCENE_RE.search(filename)
         if match:
             chapter, scene = match.group(1), match.group(2)
             # Get short caption (first 40 chars)
-            caption = get_caption(img_path, descriptions)[:40]
-            if len(get_caption(img_path, descriptions)) > 40:
+            full_caption = captions[img_path]
+            caption = full_caption[:40]
+            if len(full_caption) > 40:
                 caption += "..."
             text = f"{i+1}. Ch{chapter} Sc{scene}: {caption}"
         else:
@@ -222,40 +137,89 @@ def create_toc_page(images, descriptions, width=1024, height=1024):
 
     return img
 
-def add_caption_overlay(img_path, caption, output_path):
-    """Add caption overlay to image and save as PNG."""
+def encode_png(img):
+    """Encode a PIL image as PNG bytes.
+
+    Uses zlib level 1: several times faster than the default level 6 for a
+    modest size increase, and CBZ pages are stored without further compression.
+    """
+    buf = io.BytesIO()
+    img.save(buf, 'PNG', optimize=False, compress_level=1)
+    return buf.getvalue()
+
+@lru_cache(maxsize=4)
+def caption_strip_template(width):
+    """Blank caption background strip, built once per image width."""
+    return Image.new('RGB', (width, CAPTION_HEIGHT), color='#1a1a1a')
+
+def render_caption_strip(img_path, caption, width):
+    """Render the caption text onto a copy of the caption strip template."""
+    # Caption background comes from a pre-rendered template; only the text varies
+    strip = caption_strip_template(width).copy()
+    draw = ImageDraw.Draw(strip)
+
+    # Caption text (wrap if needed)
+    font = get_font(18, bold=True)
+    small_font = get_font(14)
+
+    # Split caption into title and description
+    if len(caption) > 60:
+        # Show chapter/scene on top, description below
+        match = SCENE_RE.search(Path(img_path).stem)
+        if match:
+            title = f"Chapter {match.group(1)}, Scene {match.group(2)}"
+            desc = caption[:80] + "..." if len(caption) > 80 else caption
+        else:
+            title = caption[:40]
+            desc = caption[40:120] if len(caption) > 40 else ""
+
+        draw.text((width//2, 25), title, fill='#e0e0e0', font=font, anchor='mm')
+        draw.text((width//2, 55), desc, fill='#aaaaaa', font=small_font, anchor='mm')
+    else:
+        draw.text((width//2, CAPTION_HEIGHT//2), caption, fill='#e0e0e0', font=font, anchor='mm')
+
+    return strip
+
+def add_caption_overlay_vips(img_path, caption):
+    """libvips variant of add_caption_overlay; returns None if the image needs Pillow."""
+    img = pyvips.Image.new_from_file(img_path, access='sequential')
+    # Only plain 8-bit RGB is handled here; anything else keeps Pillow's conversion rules
+    if img.bands != 3 or img.format != 'uchar':
+        return None
+
+    strip = render_caption_strip(img_path, caption, img.width)
+    strip = pyvips.Image.new_from_memory(strip.tobytes(), strip.width, strip.height, 3, 'uchar')
+    # The strip is opaque, so a plain insert is equivalent to compositing it over
+    img = img.insert(strip, 0, img.height - CAPTION_HEIGHT)
+    # Without row filtering libvips' PNGs come out ~50% larger than Pillow's; with
+    # adaptive filtering at level 6 they are smaller than Pillow's level 1 and still quick
+    return img.pngsave_buffer(compression=6, filter='all')
+
+def add_caption_overlay(img_path, caption):
+    """Add caption overlay to image and return it encoded as PNG bytes."""
+    if not caption:
+        # Nothing to draw: reuse the source PNG without decoding/re-encoding it
+        return Path(img_path).read_bytes()
+
+    if pyvips is not None:
+        png_data = add_caption_overlay_vips(img_path, caption)
+        if png_data is not None:
+            return png_data
+
     with Image.open(img_path) as img:
         if img.mode != 'RGB':
             img = img.convert('RGB')
 
-        draw = ImageDraw.Draw(img)
         width, height = img.size
+        img.paste(render_caption_strip(img_path, caption, width), (0, height - CAPTION_HEIGHT))
+        return encode_png(img)
 
-        # Caption background
-        caption_height = 80
-        draw.rectangle([0, height - caption_height, width, height], fill='#1a1a1aCC')
-
-        # Caption text (wrap if needed)
-        font = get_font(18, bold=True)
-        small_font = get_font(14)
-
-        # Split caption into title and description
-        if len(caption) > 60:
-            # Show chapter/scene on top, description below
-            match = re.search(r'chapter_(\d+)_scene_(\d+)', Path(img_path).stem)
-            if match:
-                title = f"Chapter {match.group(1)}, Scene {match.group(2)}"
-                desc = caption[:80] + "..." if len(caption) > 80 else caption
-            else:
-                title = caption[:40]
-                desc = caption[40:120] if len(caption) > 40 else ""
-
-            draw.text((width//2, height - caption_height + 25), title, fill='#e0e0e0', font=font, anchor='mm')
-            draw.text((width//2, height - caption_height + 55), desc, fill='#aaaaaa', font=small_font, anchor='mm')
-        else:
-            draw.text((width//2, height - caption_height//2), caption, fill='#e0e0e0', font=font, anchor='mm')
-
-        img.save(output_path, 'PNG')
+def write_png_entry(cbz, name, png_data):
+    """Write PNG bytes to the archive uncompressed (PNG data is already deflated)."""
+    info = zipfile.ZipInfo(name, date_time=time.localtime()[:6])
+    info.compress_type = zipfile.ZIP_STORED
+    info.external_attr = 0o644 << 16
+    cbz.writestr(info, png_data)
 
 def create_comicinfo_xml(title, author, num_pages):
     """Create ComicInfo.xml for CBZ metadata."""
@@ -274,59 +238,59 @@ def create_cbz(images, output_path, title="Illustrated Book", author="Unknown",
     """Create CBZ archive with metadata pages and captioned images."""
 
     descriptions = load_scene_descriptions(imaginize_dir) if imaginize_dir else {}
+    if descriptions:
+        print(f"✅ Loaded {len(descriptions)} scene descriptions")
+    # Captions are needed by both the TOC and the overlays; compute each once
+    captions = {img_path: get_caption(img_path, descriptions) for img_path in images}
 
     print(f"📦 Creating CBZ archive with {len(images)} images...")
 
-    # Create temp directory for processed images
-    import tempfile
-    with tempfile.TemporaryDirectory() as temp_dir:
-        temp_path = Path(temp_dir)
+    # Pages are rendered in memory and written straight into the archive
+    with zipfile.ZipFile(output_path, 'w', zipfile.ZIP_DEFLATED) as cbz:
+        # Add ComicInfo.xml (3 front matter pages + one page per image)
+        comic_info = create_comicinfo_xml(title, author, len(images) + 3)
+        cbz.writestr('ComicInfo.xml', comic_info)
+
         page_num = 0
 
         # Create title page
         title_img = create_title_page(title, author)
-        title_path = temp_path / f"{page_num:04d}_title.png"
-        title_img.save(title_path)
+        write_png_entry(cbz, f"{page_num:04d}_title.png", encode_png(title_img))
         page_num += 1
 
         # Create metadata page
         meta_img = create_metadata_page(title, author, len(images))
-        meta_path = temp_path / f"{page_num:04d}_metadata.png"
-        meta_img.save(meta_path)
+        write_png_entry(cbz, f"{page_num:04d}_metadata.png", encode_png(meta_img))
         page_num += 1
 
         # Create TOC page
-        toc_img = create_toc_page(images, descriptions)
-        toc_path = temp_path / f"{page_num:04d}_toc.png"
-        toc_img.save(toc_path)
+        toc_img = create_toc_page(images, captions)
+        write_png_entry(cbz, f"{page_num:04d}_toc.png", encode_png(toc_img))
         page_num += 1
 
-        # Process images with captions
-        for i, img_path in enumerate(images):
+        # Plan captioned pages in the parent so workers only decode/draw/encode
+        page_names = []
+        for img_path in images:
             filename = Path(img_path).stem
-            match = re.search(r'chapter_(\d+)_scene_(\d+)', filename)
+            match = SCENE_RE.search(filename)
             if match:
                 new_name = f"{page_num:04d}_ch{match.group(1)}_sc{match.group(2)}.png"
             else:
                 new_name = f"{page_num:04d}_{filename}.png"
 
-            caption = get_caption(img_path, descriptions)
-            out_path = temp_path / new_name
-            add_caption_overlay(img_path, caption, out_path)
+            page_names.append(new_name)
             page_num += 1
 
-            if (i + 1) % 10 == 0:
-                print(f"   Processed {i + 1}/{len(images)} images...")
-
-        # Create CBZ
-        with zipfile.ZipFile(output_path, 'w', zipfile.ZIP_DEFLATED) as cbz:
-            # Add ComicInfo.xml
-            comic_info = create_comicinfo_xml(title, author, page_num)
-            cbz.writestr('ComicInfo.xml', comic_info)
+        # Caption overlays are CPU-bound and independent, so spread them across cores;
+        # map() yields in submission order, keeping archive entries in page order
+        with ProcessPoolExecutor(max_workers=os.cpu_count()) as executor:
+            results = executor.map(add_caption_overlay, images,
+                                   [captions[img_path] for img_path in images], chunksize=4)
+            for i, (new_name, png_data) in enumerate(zip(page_names, results)):
+                write_png_entry(cbz, new_name, png_data)
 
-            # Add all pages
-            for png_file in sorted(temp_path.glob('*.png')):
-                cbz.write(png_file, png_file.name)
+                if (i + 1) % 10 == 0:
+                    print(f"   Processed {i + 1}/{len(images)} images...")
 
     size_mb = Path(output_path).stat().st_size / (1024 * 1024)
     print(f"\n✅ CBZ created: {output_path}")
@@ -5,176 +5,64 @@ Generate an HTML gallery from images with dark theme and captions.
 
 import os
 import sys
+import json
 import shutil
-import base64
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
+from html import escape
 from pathlib import Path
 from PIL import Image
-import re
-
-def collect_images(base_dir):
-    """Collect all PNG images sorted by chapter and scene."""
-    images = []
-    base_path = Path(base_dir)
-
-    if base_path.name.startswith('imaginize_'):
-        for img_file in base_path.glob('*.png'):
-            images.append(str(img_file))
-    else:
-        for img_dir in base_path.glob('imaginize_*'):
-            if img_dir.is_dir():
-                for img_file in img_dir.glob('*.png'):
-                    images.append(str(img_file))
-
-    def sort_key(path):
-        filename = Path(path).stem
-        match = re.search(r'chapter_(\d+)_scene_(\d+)', filename)
-        if match:
-            return (int(match.group(1)), int(match.group(2)))
-        return (999, 999)
-
-    images.sort(key=sort_key)
-    return images
-
-def load_scene_descriptions(imaginize_dir):
-    """Load scene descriptions from Chapters.md file."""
-    descriptions = {}
-    chapters_file = Path(imaginize_dir) / 'Chapters.md'
-
-    if not chapters_file.exists():
-        return descriptions
-
-    try:
-        with open(chapters_file, 'r', encoding='utf-8') as f:
-            content = f.read()
-
-        lines = content.split('\n')
-        i = 0
-        current_desc = ''
-
-        while i < len(lines):
-            line = lines[i].strip()
-
-            if '**Visual Elements:**' in line:
-                desc_line = line.split('**Visual Elements:**', 1)[1].strip()
-                full_desc = desc_line
-                k = i + 1
-                while k < len(lines) and lines[k].strip() and not lines[k].startswith('**'):
-                    full_desc += ' ' + lines[k].strip()
-                    k += 1
-
-                # Look for the FIRST image reference only
-                for j in range(i, min(i+15, len(lines))):
-                    if 'chapter_' in lines[j] and '_scene_' in lines[j]:
-                        match = re.search(r'chapter_(\d+)_scene_(\d+)', lines[j])
-                        if match:
-                            descriptions[(match.group(1), match.group(2))] = full_desc.strip()
-                        break
-            i += 1
-
-    except Exception as e:
-        print(f"⚠️  Warning: Could not parse Chapters.md: {e}")
-
-    return descriptions
-
-def extract_smart_caption(desc):
-    """Extract a concise caption (5-8 words) focusing on subject and location."""
-    if not desc:
-        return ""
-
-    words = desc.split()
-    result = []
-
-    # Words to skip entirely
-    skip = {'a', 'an', 'the', 'is', 'are', 'was', 'were', 'has', 'have', 'had',
-            'and', 'or', 'but', 'with', 'by', 'for', 'to', 'from', 'of',
-            'tall', 'short', 'out', 'shape', 'dressed', 'appearing', 'blurred',
-            'contrasting', 'standing', 'sitting', 'looking', 'like'}
-
-    # Capture first sentence only (before first period)
-    first_sentence = []
-    for w in words:
-        first_sentence.append(w)
-        if w.endswith('.'):
-            break
-
-    # Build caption from key words, preserving proper nouns
-    for word in first_sentence:
-        clean = word.rstrip(',.;:')
-        if not clean:
-            continue
-
-        # Always keep capitalized words (proper nouns) and location prepositions
-        if clean[0].isupper() or clean.lower() in ['in', 'at', 'on', 'near', 'before']:
-            result.append(clean)
-        elif clean.lower() not in skip and len(clean) > 2:
-            result.append(clean)
-
-        if len(result) >= 7:
-            break
-
-    return ' '.join(result) if result else desc[:50]
-
-def get_caption(img_path, descriptions):
-    """Get concise caption for image from descriptions."""
-    filename = Path(img_path).stem
-    match = re.search(r'chapter_(\d+)_scene_(\d+)', filename)
-    if match:
-        chapter, scene = match.group(1), match.group(2)
-        if (chapter, scene) in descriptions:
-            return extract_smart_caption(descriptions[(chapter, scene)])
-        return f"Chapter {chapter}, Scene {scene}"
-    return Path(img_path).stem
-
-def get_short_caption(img_path, descriptions):
-    """Get short caption for TOC display."""
-    filename = Path(img_path).stem
-    match = re.search(r'chapter_(\d+)_scene_(\d+)', filename)
-    if match:
-        chapter, scene = match.group(1), match.group(2)
-        if (chapter, scene) in descriptions:
-            desc = descriptions[(chapter, scene)][:50]
-            if len(descriptions[(chapter, scene)]) > 50:
-                desc += "..."
-            return f"Ch {chapter}, Sc {scene}: {desc}"
-        return f"Chapter {chapter}, Scene {scene}"
-    return Path(img_path).stem
+
+from _scene_utils import collect_images, load_scene_descriptions, get_caption
+
+# Gallery cards render at 280px; thumbnails are 2x that for high-DPI screens
+THUMB_SIZE = (560, 560)
+
+# Gallery card markup, filled with %-substitution for each image
+GALLERY_ITEM_TEMPLATE = '''
+    <div class="gallery-item" onclick="openModal(%(index)d)">
+      <img src="%(thumb_src)s" alt="%(caption)s" loading="lazy"/>
+      <div class="caption">%(caption)s</div>
+    </div>'''
+
+def save_thumbnail(img_path, thumb_path):
+    """Write a downscaled WebP copy of an image for its gallery card."""
+    with Image.open(img_path) as img:
+        if img.mode not in ('RGB', 'RGBA'):
+            img = img.convert('RGB')
+        img.thumbnail(THUMB_SIZE, Image.LANCZOS)
+        img.save(thumb_path, 'WEBP', quality=80, method=4)
+
+def write_assets(index, img_path, assets_dir):
+    """Copy an image and its thumbnail into the assets directory; returns their file names."""
+    img_name = f"image_{index:04d}.png"
+    thumb_name = f"thumb_{index:04d}.webp"
+    shutil.copyfile(img_path, assets_dir / img_name)
+    save_thumbnail(img_path, assets_dir / thumb_name)
+    return img_name, thumb_name
 
 def create_html_gallery(images, output_path, title="Illustrated Book", author="Unknown", imaginize_dir=None):
-    """Create HTML gallery with embedded images."""
+    """Create HTML gallery with images copied to a sibling assets directory."""
 
     descriptions = load_scene_descriptions(imaginize_dir) if imaginize_dir else {}
     output_dir = Path(output_path).parent
     html_file = Path(output_path)
+    # Images live next to the page as plain files so the browser fetches them lazily
+    # instead of decoding megabytes of inline base64 before first paint
+    assets_dir = output_dir / f"{html_file.stem}_assets"
+    assets_dir.mkdir(parents=True, exist_ok=True)
+    assets_url = quote(assets_dir.name)
 
     print(f"🌐 Creating HTML gallery with {len(images)} images...")
 
-    # Build gallery items
-    gallery_items = []
-    for i, img_path in enumerate(images):
-        caption = get_caption(img_path, descriptions)
-
-        # Read image and convert to base64 for embedding
-        with open(img_path, 'rb') as f:
-            img_data = base64.b64encode(f.read()).decode('utf-8')
-
-        gallery_items.append(f'''
-    <div class="gallery-item" onclick="openModal({i})">
-      <img src="data:image/png;base64,{img_data}" alt="{caption}" loading="lazy"/>
-      <div class="caption">{caption}</div>
-    </div>''')
-
-        if (i + 1) % 10 == 0:
-            print(f"   Processed {i + 1}/{len(images)} images...")
-
-    # Build modal data
-    modal_data = []
-    for i, img_path in enumerate(images):
-        caption = get_caption(img_path, descriptions)
-        with open(img_path, 'rb') as f:
-            img_data = base64.b64encode(f.read()).decode('utf-8')
-        modal_data.append(f'{{src: "data:image/png;base64,{img_data}", caption: "{caption}"}}')
-
-    html = f'''<!DOCTYPE html>
+    # Title and author are free text, so HTML-escape them for the markup
+    title = escape(title)
+    author = escape(author)
+
+    # The page is written as it is built: header, one card per image, then the
+    # modal script, so the full document never has to sit in memory at once
+    with open(html_file, 'w', encoding='utf-8') as f:
+        f.write(f'''<!DOCTYPE html>
 <html lang="en">
 <head>
   <meta charset="UTF-8">
@@ -305,7 +193,36 @@ def create_html_gallery(images, output_path, title="Illustrated Book", author="U
   </header>
 
   <div class="gallery">
-    {''.join(gallery_items)}
+    ''')
+
+        # Copying and thumbnailing are file I/O and Pillow C code, both of which release
+        # the GIL, so a thread pool overlaps them; map() keeps results in image order
+        with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+            assets = executor.map(write_assets, range(len(images)), images, [assets_dir] * len(images))
+
+            modal_data = []
+            for i, (img_path, (img_name, thumb_name)) in enumerate(zip(images, assets)):
+                caption = get_caption(img_path, descriptions)
+
+                # Cards show a small thumbnail; the modal opens the full-resolution image
+                img_src = f"{assets_url}/{img_name}"
+                thumb_src = f"{assets_url}/{thumb_name}"
+
+                f.write(GALLERY_ITEM_TEMPLATE % {
+                    'index': i,
+                    'thumb_src': thumb_src,
+                    'caption': escape(caption),
+                })
+                modal_data.append({'src': img_src, 'caption': caption})
+
+                if (i + 1) % 10 == 0:
+                    print(f"   Processed {i + 1}/{len(images)} images...")
+
+        # Captions in the modal data are JSON-encoded, with "</" broken up so a
+        # caption cannot close the script element
+        modal_json = json.dumps(modal_data, ensure_ascii=False).replace('</', '<\\/')
+
+        f.write(f'''
   </div>
 
   <div class="modal" id="modal">
@@ -323,7 +240,7 @@ def create_html_gallery(images, output_path, title="Illustrated Book", author="U
   </footer>
 
   <script>
-    const images = [{','.join(modal_data)}];
+    const images = {modal_json};
     let currentIndex = 0;
 
     function openModal(index) {{
@@ -359,14 +276,12 @@ def create_html_gallery(images, output_path, title="Illustrated Book", author="U
     }});
   </script>
 </body>
-</html>'''
-
-    with open(html_file, 'w', encoding='utf-8') as f:
-        f.write(html)
+</html>''')
 
     size_mb = html_file.stat().st_size / (1024 * 1024)
     print(f"\n✅ HTML gallery created: {html_file}")
     print(f"   Total images: {len(images)}")
+    print(f"   Image assets: {assets_dir}")
     print(f"   File size: {size_mb:.1f} MB")
 
 if __name__ == "__main__":
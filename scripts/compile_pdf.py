@@ -5,36 +5,92 @@ Features: Dark theme, cover generation, QR codes, enhanced captions.
 """
 
 import os
+import re
 import json
 import sys
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
 from pathlib import Path
 from PIL import Image, ImageStat, ImageDraw, ImageFont
+from reportlab import rl_config
 from reportlab.lib.pagesizes import letter
 from reportlab.lib.units import inch
 from reportlab.pdfgen import canvas
-from reportlab.lib.colors import HexColor
-import qrcode
+from reportlab.lib.colors import HexColor, black, white
+from reportlab.lib.utils import ImageReader
+from reportlab.graphics import renderPDF
+from reportlab.graphics.barcode.qr import QrCodeWidget
+from reportlab.graphics.shapes import Drawing, Rect
 from io import BytesIO
 from openai import OpenAI
 
+try:
+    import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+except ImportError:
+    requests = None
+
+try:
+    from pypdf import PdfWriter
+except ImportError:
+    PdfWriter = None
+
+from _scene_utils import collect_images, load_scene_descriptions
+
 # Dark theme colors
 BG_COLOR = HexColor('#1a1a1a')  # Dark background
+BG_FORM = 'page_background'  # Form XObject holding the full-page background
 TEXT_COLOR = HexColor('#e0e0e0')  # Light text
 ACCENT_COLOR = HexColor('#4a9eff')  # Blue accent
 
-def generate_cover_image(title, author, output_path):
+# Embed image data as plain Flate streams: the ASCII85 wrapper ReportLab adds by
+# default costs an extra encoding pass and makes every image ~25% larger
+rl_config.useA85 = 0
+rl_config.pageCompression = 1
+
+# Image page layout: a 2x2 grid of images on a letter page, each above its caption
+IMAGES_PER_PAGE = 4
+GRID_COLS = 2
+GRID_ROWS = 2
+MARGIN = 0.5 * inch
+SPACING = 0.25 * inch
+CAPTION_HEIGHT = 0.4 * inch  # Increased for more info
+IMG_WIDTH = (letter[0] - (2 * MARGIN) - SPACING) / GRID_COLS
+IMG_HEIGHT = (letter[1] - (2 * MARGIN) - SPACING - (GRID_ROWS * CAPTION_HEIGHT)) / GRID_ROWS
+
+# Markdown bold markers and status emoji stripped from scene descriptions
+_CAPTION_CLEAN_RE = re.compile(r'\*\*|ℹ️|⏳')
+# Common words left out of the short image-page captions
+_CAPTION_SKIP_WORDS = frozenset({'the', 'a', 'an', 'in', 'on', 'at', 'to', 'for', 'of', 'with',
+                                 'and', 'or', 'is', 'are', 'was', 'were'})
+
+# Shared HTTP session for image downloads: keeps connections alive between
+# requests and retries transient failures instead of failing the cover outright
+if requests is not None:
+    _HTTP = requests.Session()
+    _HTTP.mount('https://', HTTPAdapter(pool_connections=4, pool_maxsize=4,
+                                        max_retries=Retry(total=3, backoff_factor=0.3)))
+else:
+    _HTTP = None
+
+def generate_cover_image(title, author):
     """
     Generate a cover image using DALL-E 3.
 
     Args:
         title: Book title
         author: Author name
-        output_path: Where to save the cover image
 
     Returns:
-        Path to generated cover image
+        The cover kept in memory: the downloaded image as a BytesIO, or a
+        PIL Image for the placeholder
     """
     try:
+        # Check before calling the API so an image we cannot download is never paid for
+        if _HTTP is None:
+            raise RuntimeError("the requests package is required to download the cover")
+
         client = OpenAI()
 
         prompt = f"""Create an epic, cinematic book cover illustration for "{title}" by {author}.
@@ -52,16 +108,17 @@ def generate_cover_image(title, author, output_path):
             n=1,
         )
 
-        # Download the image
-        import requests
+        # Download the image in chunks; it goes straight into the PDF, never to disk
         img_url = response.data[0].url
-        img_data = requests.get(img_url).content
+        cover = BytesIO()
+        with _HTTP.get(img_url, stream=True, timeout=30) as r:
+            r.raise_for_status()
+            for chunk in r.iter_content(1 << 16):
+                cover.write(chunk)
+        cover.seek(0)
 
-        with open(output_path, 'wb') as f:
-            f.write(img_data)
-
-        print(f"✅ Cover image saved: {output_path}")
-        return output_path
+        print("✅ Cover image downloaded")
+        return cover
 
     except Exception as e:
         print(f"⚠️  Cover generation failed: {e}")
@@ -83,130 +140,31 @@ def generate_cover_image(title, author, output_path):
         draw.text((512, 400), title, fill='#e0e0e0', font=font, anchor='mm')
         draw.text((512, 500), f"by {author}", fill='#888888', font=font_small, anchor='mm')
 
-        img.save(output_path)
-        print(f"✅ Placeholder cover saved: {output_path}")
-        return output_path
+        print("✅ Placeholder cover created")
+        return img
 
-def generate_qr_code(url, size=150):
+def generate_qr_code(url, size=1.2*inch):
     """
-    Generate QR code for URL and return as PIL Image.
+    Generate QR code for URL as vector graphics.
 
     Args:
         url: URL to encode
-        size: Size of QR code in pixels
+        size: Width and height of the QR code in points
 
     Returns:
-        PIL Image of QR code
-    """
-    qr = qrcode.QRCode(
-        version=1,
-        error_correction=qrcode.constants.ERROR_CORRECT_L,
-        box_size=10,
-        border=2,
-    )
-    qr.add_data(url)
-    qr.make(fit=True)
-
-    img = qr.make_image(fill_color="white", back_color="black")
-    img = img.resize((size, size), Image.Resampling.LANCZOS)
-
-    return img
-
-def load_scene_descriptions(imaginize_dir):
+        ReportLab Drawing of the QR code: white modules on a black square
     """
-    Load scene descriptions from Chapters.md file.
-
-    Args:
-        imaginize_dir: Path to imaginize output directory
-
-    Returns:
-        dict mapping (chapter, scene) tuples to descriptions
-    """
-    descriptions = {}
-    chapters_file = Path(imaginize_dir) / 'Chapters.md'
-
-    if not chapters_file.exists():
-        print(f"⚠️  Chapters.md not found in {imaginize_dir}")
-        return descriptions
-
-    try:
-        with open(chapters_file, 'r', encoding='utf-8') as f:
-            content = f.read()
-
-        # Parse markdown to extract Visual Elements descriptions
-        import re
-
-        # Pattern to match chapter headers: ### [chapter_name or number]
-        chapter_pattern = re.compile(r'^###\s+(.+)$', re.MULTILINE)
-        # Pattern to match scene headers: #### Scene [number]
-        scene_pattern = re.compile(r'^####\s+Scene\s+(\d+)', re.MULTILINE)
-        # Pattern to match Visual Elements line
-        visual_pattern = re.compile(r'\*\*Visual Elements:\*\*\s*(.+?)(?:\n\n|\n\*\*|$)', re.DOTALL)
-
-        current_chapter = None
-        lines = content.split('\n')
-        i = 0
-
-        while i < len(lines):
-            line = lines[i].strip()
-
-            # Match chapter headers (### [chapter])
-            chapter_match = re.match(r'^###\s+(.+)$', line)
-            if chapter_match:
-                current_chapter = chapter_match.group(1).strip()
-                # Try to extract numeric chapter if possible
-                # Some chapters are "1", "2", others are "[04-04-2002:version1", "ENDYMION" etc
-                # We'll keep the original and try to match with filenames later
-                i += 1
-                continue
-
-            # Match scene headers (#### Scene [number])
-            scene_match = re.match(r'^####\s+Scene\s+(\d+)', line)
-            if scene_match and current_chapter:
-                scene_num = scene_match.group(1)
-
-                visual_desc = None
-                img_filename = None
-
-                # Look ahead for **Visual Elements:** and **Generated Image:** sections
-                for j in range(i+1, min(i+20, len(lines))):
-                    # Extract Visual Elements description
-                    if '**Visual Elements:**' in lines[j] and not visual_desc:
-                        # Extract description from this line
-                        desc_line = lines[j].split('**Visual Elements:**', 1)[1].strip()
-
-                        # If description continues on next lines, collect them
-                        full_desc = desc_line
-                        k = j + 1
-                        while k < len(lines) and lines[k].strip() and not lines[k].startswith('**'):
-                            full_desc += ' ' + lines[k].strip()
-                            k += 1
-
-                        visual_desc = full_desc.strip()
-
-                    # Extract the actual image filename for mapping
-                    if '**Generated Image:**' in lines[j] or 'View Image' in lines[j]:
-                        # Extract filename from patterns like:
-                        # **Generated Image:** [View Image](./chapter_4_scene_1.png)
-                        match = re.search(r'chapter_(\d+)_scene_(\d+)\.png', lines[j])
-                        if match:
-                            img_chapter = match.group(1)
-                            img_scene = match.group(2)
-                            # Store using the ACTUAL filename chapter/scene numbers
-                            if visual_desc:
-                                descriptions[(img_chapter, img_scene)] = visual_desc
-                            break
-
-            i += 1
-
-        print(f"✅ Loaded {len(descriptions)} scene descriptions from Chapters.md")
-
-    except Exception as e:
-        print(f"⚠️  Warning: Could not parse Chapters.md: {e}")
-        import traceback
-        traceback.print_exc()
-
-    return descriptions
+    modules = QrCodeWidget(url, barLevel='L', barBorder=2, barWidth=size, barHeight=size,
+                           barFillColor=white).draw()
+    # The widget's rectangles keep the default black outline, which would eat into
+    # the white modules
+    for shape in modules.contents:
+        shape.strokeColor = None
+
+    drawing = Drawing(size, size)
+    drawing.add(Rect(0, 0, size, size, fillColor=black, strokeColor=None))
+    drawing.add(modules)
+    return drawing
 
 def parse_image_metadata(image_path, imaginize_dir, scene_descriptions=None):
     """
@@ -235,18 +193,17 @@ def parse_image_metadata(image_path, imaginize_dir, scene_descriptions=None):
     # Try to get description from scene_descriptions dict
     description = "Scene illustration"
 
-    if scene_descriptions and (chapter, scene) in scene_descriptions:
-        desc = scene_descriptions[(chapter, scene)]
+    if scene_descriptions and scene_descriptions.get((chapter, scene)):
         # Clean up description
-        desc = desc.replace('**', '').replace('ℹ️', '').replace('⏳', '').strip()
+        desc = _CAPTION_CLEAN_RE.sub('', scene_descriptions[(chapter, scene)]).strip()
         # Extract 2-5 key words for concise caption
         words = desc.split()
-        # Filter out common words and keep meaningful ones
-        skip_words = {'the', 'a', 'an', 'in', 'on', 'at', 'to', 'for', 'of', 'with', 'and', 'or', 'is', 'are', 'was', 'were'}
-        key_words = [w for w in words if w.lower() not in skip_words][:5]
+        # Filter out common words and keep meaningful ones; stops after the fifth
+        key_words = list(islice((w for w in words if w.lower() not in _CAPTION_SKIP_WORDS), 5))
         if len(key_words) < 2:
             key_words = words[:3]  # Fallback to first 3 words if filtering removed too much
-        description = ' '.join(key_words[:5]) if key_words else desc.split()[0]
+        if key_words:
+            description = ' '.join(key_words)
     elif imaginize_dir:
         # Fallback: try to parse from log file
         log_file = Path(imaginize_dir).parent / f"{Path(imaginize_dir).stem.replace('imaginize_', '')}-full.log"
@@ -265,43 +222,102 @@ def parse_image_metadata(image_path, imaginize_dir, scene_descriptions=None):
         'chapter': chapter,
         'scene': scene,
         'title': title,
-        'description': description,
-        'filename': Path(image_path).name
+        'description': description
     }
 
-def collect_images(base_dir):
+def define_page_background(c):
+    """Record the dark page background once as a form; pages then paint it with doForm."""
+    width, height = letter
+    c.beginForm(BG_FORM)
+    c.setFillColor(BG_COLOR)
+    c.rect(0, 0, width, height, fill=1, stroke=0)
+    c.endForm()
+
+def draw_image_page(c, sources, metas, page_number):
+    """Draw one page of the image grid: up to IMAGES_PER_PAGE images with their captions."""
+    width, height = letter
+
+    # Dark background
+    c.doForm(BG_FORM)
+
+    # Images first; captions are then drawn in passes that each set the fill colour or
+    # font once, instead of switching state for every tile
+    captions = []
+    for idx, img_path in enumerate(sources):
+        row = idx // GRID_COLS
+        col = idx % GRID_COLS
+
+        # Calculate position
+        x = MARGIN + (col * (IMG_WIDTH + SPACING))
+        y = height - MARGIN - (row + 1) * IMG_HEIGHT - (row * (SPACING + CAPTION_HEIGHT))
+
+        # Draw image
+        try:
+            c.drawImage(img_path, x, y, width=IMG_WIDTH, height=IMG_HEIGHT,
+                       preserveAspectRatio=True, anchor='sw', mask='auto')
+
+            # Get metadata
+            meta = metas[idx]
+
+            # Calculate page number from source book
+            # Assume ~5 pages per image
+            source_page = int(meta['chapter']) * 15 + int(meta['scene']) * 5
+
+            caption_line1 = f"Ch {meta['chapter']}, Scene {meta['scene']} • Page ~{source_page}"
+            captions.append((x + IMG_WIDTH/2, y - CAPTION_HEIGHT, caption_line1, meta['description']))
+
+        except Exception as e:
+            print(f"⚠️  Error processing {img_path}: {e}")
+            # Draw placeholder
+            c.setFillColorRGB(0.2, 0.2, 0.2)
+            c.rect(x, y, IMG_WIDTH, IMG_HEIGHT, fill=1)
+            c.setFillColor(TEXT_COLOR)
+            c.drawCentredString(x + IMG_WIDTH/2, y + IMG_HEIGHT/2, "Error loading image")
+
+    # Caption with dark background
+    c.setFillColorRGB(0.1, 0.1, 0.1, alpha=0.85)
+    for center_x, caption_y, _, _ in captions:
+        c.rect(center_x - IMG_WIDTH/2, caption_y, IMG_WIDTH, CAPTION_HEIGHT, fill=1, stroke=0)
+
+    # Caption text (multi-line)
+    c.setFillColor(TEXT_COLOR)
+    c.setFont("Helvetica-Bold", 9)
+    for center_x, caption_y, caption_line1, _ in captions:
+        c.drawCentredString(center_x, caption_y + CAPTION_HEIGHT - 0.12*inch, caption_line1)
+
+    c.setFont("Helvetica", 8)
+    for center_x, caption_y, _, description in captions:
+        c.drawCentredString(center_x, caption_y + CAPTION_HEIGHT - 0.25*inch, description)
+
+    # Page number at bottom
+    c.setFillColor(TEXT_COLOR)
+    c.setFont("Helvetica", 10)
+    c.drawCentredString(width/2, 0.5*inch, str(page_number))
+
+    c.showPage()
+
+def render_image_pages(sources, metas, first_page):
     """
-    Collect all PNG images from book directories.
+    Render a run of image pages as a standalone in-memory PDF.
+
+    Runs in a worker process, so it takes and returns only picklable values.
+
+    Args:
+        sources: Image paths for this run of pages
+        metas: Metadata dicts matching sources
+        first_page: Page number printed on the first page
 
     Returns:
-        List of image paths sorted by chapter and scene (numerically)
+        The PDF as bytes
     """
-    images = []
-    base_path = Path(base_dir)
-
-    # If base_dir is a specific imaginize directory, use it directly
-    if base_path.name.startswith('imaginize_'):
-        for img_file in base_path.glob('*.png'):
-            images.append(str(img_file))
-    else:
-        # Otherwise scan for imaginize_* directories
-        for img_dir in base_path.glob('imaginize_*'):
-            if img_dir.is_dir():
-                for img_file in img_dir.glob('*.png'):
-                    images.append(str(img_file))
-
-    # Sort numerically by chapter and scene (chapter_X_scene_Y.png)
-    def sort_key(path):
-        import re
-        filename = Path(path).stem
-        # Extract chapter and scene numbers
-        match = re.search(r'chapter_(\d+)_scene_(\d+)', filename)
-        if match:
-            return (int(match.group(1)), int(match.group(2)))
-        return (999, 999)  # Put non-matching files at end
-
-    images.sort(key=sort_key)
-    return images
+    buffer = BytesIO()
+    c = canvas.Canvas(buffer, pagesize=letter)
+    define_page_background(c)
+    for start in range(0, len(sources), IMAGES_PER_PAGE):
+        draw_image_page(c, sources[start:start + IMAGES_PER_PAGE], metas[start:start + IMAGES_PER_PAGE],
+                        first_page + start // IMAGES_PER_PAGE)
+    c.save()
+    return buffer.getvalue()
 
 def create_pdf(images, output_path, title="Illustrated Book", author="Unknown", imaginize_dir=None):
     """
@@ -318,242 +334,203 @@ def create_pdf(images, output_path, title="Illustrated Book", author="Unknown",
     scene_descriptions = {}
     if imaginize_dir:
         print("📖 Loading scene descriptions...")
+        if not (Path(imaginize_dir) / 'Chapters.md').exists():
+            print(f"⚠️  Chapters.md not found in {imaginize_dir}")
         scene_descriptions = load_scene_descriptions(imaginize_dir)
         print(f"   Found {len(scene_descriptions)} scene descriptions")
 
-    c = canvas.Canvas(output_path, pagesize=letter)
-    width, height = letter  # 8.5 x 11 inches
-
-    # Configuration
-    images_per_page = 4
-    grid_cols = 2
-    grid_rows = 2
-    margin = 0.5 * inch
-    spacing = 0.25 * inch
-    caption_height = 0.4 * inch  # Increased for more info
+    # Per-image metadata is needed by both the TOC and the image pages; parse it once
+    metas = [parse_image_metadata(p, imaginize_dir, scene_descriptions) for p in images]
+
+    # ReportLab embeds one image XObject per distinct file name and decodes the file only
+    # the first time it sees that name; canonical paths let repeats of the same file
+    # (symlinks, relative vs. absolute paths) share it. File names are used rather than
+    # ImageReader objects, which ReportLab fingerprints by hashing their decoded pixels.
+    image_sources = [os.path.realpath(p) for p in images]
+
+    # Image pages are independent, so with pypdf available they are rendered in worker
+    # processes (a contiguous run of pages each) while the front matter is drawn here,
+    # then merged. map() submits every run up front and yields the parts in order.
+    num_image_pages = (len(images) + IMAGES_PER_PAGE - 1) // IMAGES_PER_PAGE
+    workers = min(os.cpu_count() or 1, num_image_pages)
+    use_workers = PdfWriter is not None and workers > 1
+    if use_workers:
+        executor = ProcessPoolExecutor(max_workers=workers)
+    try:
+        if use_workers:
+            run = -(-num_image_pages // workers) * IMAGES_PER_PAGE
+            starts = range(0, len(images), run)
+            image_parts = executor.map(render_image_pages,
+                                       [image_sources[i:i + run] for i in starts],
+                                       [metas[i:i + run] for i in starts],
+                                       [i // IMAGES_PER_PAGE + 4 for i in starts])
+            front_matter = BytesIO()
 
-    # Calculate image dimensions
-    available_width = width - (2 * margin) - spacing
-    available_height = height - (2 * margin) - spacing - (grid_rows * caption_height)
-    img_width = available_width / grid_cols
-    img_height = available_height / grid_rows
+        c = canvas.Canvas(front_matter if use_workers else output_path, pagesize=letter)
+        define_page_background(c)
+        width, height = letter  # 8.5 x 11 inches
 
-    # === Page 1: Cover ===
-    print("📖 Creating cover page...")
+        # === Page 1: Cover ===
+        print("📖 Creating cover page...")
 
-    # Generate cover image
-    cover_path = Path(output_path).parent / f"{Path(output_path).stem}_cover.png"
-    generate_cover_image(title, author, cover_path)
+        # Generate cover image
+        cover = generate_cover_image(title, author)
 
-    # Dark background
-    c.setFillColor(BG_COLOR)
-    c.rect(0, 0, width, height, fill=1, stroke=0)
+        # Dark background
+        c.doForm(BG_FORM)
 
-    # Draw cover image
-    if cover_path.exists():
-        c.drawImage(str(cover_path), inch, 2*inch, width=6.5*inch, height=6.5*inch,
+        # Draw cover image
+        c.drawImage(ImageReader(cover), inch, 2*inch, width=6.5*inch, height=6.5*inch,
                    preserveAspectRatio=True, anchor='c')
 
-    # Title and author overlay at bottom
-    c.setFillColor(TEXT_COLOR)
-    c.setFont("Helvetica-Bold", 42)
-    c.drawCentredString(width/2, 1.5*inch, title)
-    c.setFont("Helvetica", 24)
-    c.drawCentredString(width/2, inch, f"by {author}")
-
-    c.showPage()
-
-    # === Page 2: Credits ===
-    print("✨ Creating credits page...")
-
-    # Dark background
-    c.setFillColor(BG_COLOR)
-    c.rect(0, 0, width, height, fill=1, stroke=0)
-
-    # Title
-    c.setFillColor(TEXT_COLOR)
-    c.setFont("Helvetica", 32)
-    c.drawCentredString(width/2, height - 2*inch, "AI Illustrated by")
-
-    c.setFont("Helvetica-BoldOblique", 48)
-    c.setFillColor(ACCENT_COLOR)
-    c.drawCentredString(width/2, height - 2.8*inch, "imaginize")
-
-    # QR code and URL in bottom right
-    github_url = "https://github.com/tribixbite/imaginize"
-
-    # Generate QR code
-    qr_img = generate_qr_code(github_url, size=120)
-    qr_path = Path(output_path).parent / f"{Path(output_path).stem}_qr.png"
-    qr_img.save(qr_path)
-
-    # Draw QR code
-    qr_x = width - 2*inch
-    qr_y = inch
-    c.drawImage(str(qr_path), qr_x, qr_y, width=1.2*inch, height=1.2*inch)
-
-    # URL text below QR
-    c.setFillColor(TEXT_COLOR)
-    c.setFont("Helvetica", 8)
-    c.drawCentredString(qr_x + 0.6*inch, qr_y - 0.2*inch, "github.com/tribixbite/imaginize")
+        # Title and author overlay at bottom
+        c.setFillColor(TEXT_COLOR)
+        c.setFont("Helvetica-Bold", 42)
+        c.drawCentredString(width/2, 1.5*inch, title)
+        c.setFont("Helvetica", 24)
+        c.drawCentredString(width/2, inch, f"by {author}")
 
-    c.showPage()
+        c.showPage()
 
-    # === Page 3: Metadata ===
-    print("📊 Creating metadata page...")
+        # === Page 2: Credits ===
+        print("✨ Creating credits page...")
 
-    # Dark background
-    c.setFillColor(BG_COLOR)
-    c.rect(0, 0, width, height, fill=1, stroke=0)
+        # Dark background
+        c.doForm(BG_FORM)
 
-    c.setFillColor(TEXT_COLOR)
-    c.setFont("Helvetica-Bold", 28)
-    c.drawString(margin, height - margin - 0.5*inch, "Generation Metadata")
-
-    c.setFont("Helvetica", 12)
-    y = height - margin - inch
-
-    metadata = [
-        ("Book Title", title),
-        ("Author", author),
-        ("Total Images", str(len(images))),
-        ("Pages", str((len(images) + images_per_page - 1) // images_per_page + 3)),
-        ("", ""),
-        ("AI Models Used", ""),
-        ("  Text Analysis", "Google Gemini 2.0 Flash (free tier)"),
-        ("  Image Generation", "OpenAI DALL-E 3"),
-        ("  PDF Compilation", "Python (Pillow + ReportLab)"),
-        ("", ""),
-        ("Configuration", ""),
-        ("  Pages per Image", "5"),
-        ("  Image Quality", "Standard (1024x1024)"),
-        ("  Processing", "Automated via imaginize"),
-    ]
-
-    for label, value in metadata:
-        if label:
-            c.setFont("Helvetica-Bold", 11)
-            c.drawString(margin + 0.25*inch, y, f"{label}:")
-            c.setFont("Helvetica", 11)
-            c.drawString(margin + 2.5*inch, y, value)
-        y -= 0.25 * inch
-
-        if y < 2*inch:
-            break
+        # Title
+        c.setFillColor(TEXT_COLOR)
+        c.setFont("Helvetica", 32)
+        c.drawCentredString(width/2, height - 2*inch, "AI Illustrated by")
 
-    c.showPage()
+        c.setFont("Helvetica-BoldOblique", 48)
+        c.setFillColor(ACCENT_COLOR)
+        c.drawCentredString(width/2, height - 2.8*inch, "imaginize")
 
-    # === Page 4+: Table of Contents ===
-    print("📑 Creating table of contents...")
+        # QR code and URL in bottom right
+        github_url = "https://github.com/tribixbite/imaginize"
 
-    # Dark background
-    c.setFillColor(BG_COLOR)
-    c.rect(0, 0, width, height, fill=1, stroke=0)
+        # Draw QR code; it is vector artwork, so there is no bitmap to encode or embed
+        qr_x = width - 2*inch
+        qr_y = inch
+        renderPDF.draw(generate_qr_code(github_url, size=1.2*inch), c, qr_x, qr_y)
 
-    c.setFillColor(TEXT_COLOR)
-    c.setFont("Helvetica-Bold", 24)
-    c.drawString(margin, height - margin - 0.5*inch, "Table of Contents")
-    c.setFont("Helvetica", 10)
+        # URL text below QR
+        c.setFillColor(TEXT_COLOR)
+        c.setFont("Helvetica", 8)
+        c.drawCentredString(qr_x + 0.6*inch, qr_y - 0.2*inch, "github.com/tribixbite/imaginize")
 
-    toc_y = height - margin - inch
-    page_num = 4  # Start after cover, credits, metadata
+        c.showPage()
 
-    for i in range(0, len(images), images_per_page):
-        batch = images[i:i+images_per_page]
-        first_meta = parse_image_metadata(batch[0], imaginize_dir, scene_descriptions)
-        last_meta = parse_image_metadata(batch[-1], imaginize_dir, scene_descriptions)
+        # === Page 3: Metadata ===
+        print("📊 Creating metadata page...")
 
-        entry = f"Page {page_num}: Chapters {first_meta['chapter']}-{last_meta['chapter']}"
+        # Dark background
+        c.doForm(BG_FORM)
 
         c.setFillColor(TEXT_COLOR)
-        c.drawString(margin + 0.25*inch, toc_y, entry)
-        c.drawRightString(width - margin, toc_y, str(page_num))
-        toc_y -= 0.25 * inch
-
-        if toc_y < 2*inch:  # New TOC page if needed
-            c.showPage()
-            c.setFillColor(BG_COLOR)
-            c.rect(0, 0, width, height, fill=1, stroke=0)
-            c.setFillColor(TEXT_COLOR)
-            c.setFont("Helvetica", 10)
-            toc_y = height - margin - 0.5*inch
-
-        page_num += 1
+        c.setFont("Helvetica-Bold", 28)
+        c.drawString(MARGIN, height - MARGIN - 0.5*inch, "Generation Metadata")
+
+        c.setFont("Helvetica", 12)
+        y = height - MARGIN - inch
+
+        metadata = [
+            ("Book Title", title),
+            ("Author", author),
+            ("Total Images", str(len(images))),
+            ("Pages", str((len(images) + IMAGES_PER_PAGE - 1) // IMAGES_PER_PAGE + 3)),
+            ("", ""),
+            ("AI Models Used", ""),
+            ("  Text Analysis", "Google Gemini 2.0 Flash (free tier)"),
+            ("  Image Generation", "OpenAI DALL-E 3"),
+            ("  PDF Compilation", "Python (Pillow + ReportLab)"),
+            ("", ""),
+            ("Configuration", ""),
+            ("  Pages per Image", "5"),
+            ("  Image Quality", "Standard (1024x1024)"),
+            ("  Processing", "Automated via imaginize"),
+        ]
+
+        for label, value in metadata:
+            if label:
+                c.setFont("Helvetica-Bold", 11)
+                c.drawString(MARGIN + 0.25*inch, y, f"{label}:")
+                c.setFont("Helvetica", 11)
+                c.drawString(MARGIN + 2.5*inch, y, value)
+            y -= 0.25 * inch
+
+            if y < 2*inch:
+                break
 
-    c.showPage()
+        c.showPage()
 
-    # === Image Pages ===
-    print(f"🖼️  Creating {len(images)} image pages...")
+        # === Page 4+: Table of Contents ===
+        print("📑 Creating table of contents...")
 
-    for page_idx in range(0, len(images), images_per_page):
         # Dark background
-        c.setFillColor(BG_COLOR)
-        c.rect(0, 0, width, height, fill=1, stroke=0)
-
-        batch = images[page_idx:page_idx+images_per_page]
-
-        for idx, img_path in enumerate(batch):
-            row = idx // grid_cols
-            col = idx % grid_cols
+        c.doForm(BG_FORM)
 
-            # Calculate position
-            x = margin + (col * (img_width + spacing))
-            y = height - margin - (row + 1) * img_height - (row * (spacing + caption_height))
+        c.setFillColor(TEXT_COLOR)
+        c.setFont("Helvetica-Bold", 24)
+        c.drawString(MARGIN, height - MARGIN - 0.5*inch, "Table of Contents")
+        c.setFont("Helvetica", 10)
 
-            # Draw image
-            try:
-                c.drawImage(img_path, x, y, width=img_width, height=img_height,
-                           preserveAspectRatio=True, anchor='sw')
+        toc_y = height - MARGIN - inch
+        page_num = 4  # Start after cover, credits, metadata
 
-                # Get metadata
-                meta = parse_image_metadata(img_path, imaginize_dir, scene_descriptions)
+        for i in range(0, len(images), IMAGES_PER_PAGE):
+            first_meta = metas[i]
+            last_meta = metas[min(i + IMAGES_PER_PAGE, len(images)) - 1]
 
-                # Calculate page number from source book
-                # Assume ~5 pages per image
-                source_page = int(meta['chapter']) * 15 + int(meta['scene']) * 5
+            entry = f"Page {page_num}: Chapters {first_meta['chapter']}-{last_meta['chapter']}"
 
-                # Caption with dark background
-                c.setFillColorRGB(0.1, 0.1, 0.1, alpha=0.85)
-                caption_y = y - caption_height
-                c.rect(x, caption_y, img_width, caption_height, fill=1, stroke=0)
+            c.setFillColor(TEXT_COLOR)
+            c.drawString(MARGIN + 0.25*inch, toc_y, entry)
+            c.drawRightString(width - MARGIN, toc_y, str(page_num))
+            toc_y -= 0.25 * inch
 
-                # Caption text (multi-line)
-                c.setFillColor(TEXT_COLOR)
-                c.setFont("Helvetica-Bold", 9)
-                caption_line1 = f"Ch {meta['chapter']}, Scene {meta['scene']} • Page ~{source_page}"
-                c.drawCentredString(x + img_width/2, caption_y + caption_height - 0.12*inch, caption_line1)
-
-                c.setFont("Helvetica", 8)
-                c.drawCentredString(x + img_width/2, caption_y + caption_height - 0.25*inch, meta['description'])
-
-            except Exception as e:
-                print(f"⚠️  Error processing {img_path}: {e}")
-                # Draw placeholder
-                c.setFillColorRGB(0.2, 0.2, 0.2)
-                c.rect(x, y, img_width, img_height, fill=1)
+            if toc_y < 2*inch:  # New TOC page if needed
+                c.showPage()
+                c.doForm(BG_FORM)
                 c.setFillColor(TEXT_COLOR)
-                c.drawCentredString(x + img_width/2, y + img_height/2, "Error loading image")
+                c.setFont("Helvetica", 10)
+                toc_y = height - MARGIN - 0.5*inch
 
-        # Page number at bottom
-        c.setFillColor(TEXT_COLOR)
-        c.setFont("Helvetica", 10)
-        current_page = (page_idx // images_per_page) + 4  # +4 for cover, credits, metadata, TOC
-        c.drawCentredString(width/2, 0.5*inch, str(current_page))
+            page_num += 1
 
         c.showPage()
 
-    # Save PDF
-    c.save()
-
-    # Clean up temp files
-    if cover_path.exists():
-        os.remove(cover_path)
-    if qr_path.exists():
-        os.remove(qr_path)
+        # === Image Pages ===
+        print(f"🖼️  Creating {len(images)} image pages...")
+
+        if use_workers:
+            # Image pages were rendered by the workers while the front matter was drawn;
+            # stitch the parts together behind it
+            c.save()
+            writer = PdfWriter()
+            writer.append(front_matter)
+            for part in image_parts:
+                writer.append(BytesIO(part))
+            # Each part embeds its own copy of the images it draws; fold images (and the
+            # page background) repeated across parts back into one object each
+            writer.compress_identical_objects()
+            writer.write(output_path)
+        else:
+            for page_idx in range(0, len(images), IMAGES_PER_PAGE):
+                draw_image_page(c, image_sources[page_idx:page_idx + IMAGES_PER_PAGE],
+                                metas[page_idx:page_idx + IMAGES_PER_PAGE],
+                                page_idx // IMAGES_PER_PAGE + 4)  # +4 for cover, credits, metadata, TOC
+            c.save()
+    finally:
+        if use_workers:
+            # On success every run has been consumed; if drawing or merging failed,
+            # drop the runs still queued instead of rendering pages that are discarded
+            executor.shutdown(cancel_futures=True)
 
     print(f"\n✅ PDF created: {output_path}")
     print(f"   Total images: {len(images)}")
-    print(f"   Total pages: {(len(images) + images_per_page - 1) // images_per_page + 4}")
+    print(f"   Total pages: {(len(images) + IMAGES_PER_PAGE - 1) // IMAGES_PER_PAGE + 4}")
 
 if __name__ == "__main__":
     import argparse
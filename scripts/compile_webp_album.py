@@ -2,138 +2,60 @@
 """
 Compile images into optimized WebP format album (smaller than PNG).
 Creates a directory of WebP images with metadata JSON.
+
+If pyvips (libvips) is installed it is used to decode, composite and encode the
+scene images, streaming the PNG instead of materializing it through Pillow.
+The Pillow fallback needs no code changes to run under Pillow-SIMD
+(`pip install pillow-simd` in place of pillow), whose vectorized resample and
+convert loops speed up the --max-size downscale.
 """
 
 import os
 import sys
 import json
+from datetime import datetime
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
 from pathlib import Path
 from PIL import Image, ImageDraw, ImageFont
-import re
-
-def collect_images(base_dir):
-    """Collect all PNG images sorted by chapter and scene."""
-    images = []
-    base_path = Path(base_dir)
-
-    if base_path.name.startswith('imaginize_'):
-        for img_file in base_path.glob('*.png'):
-            images.append(str(img_file))
-    else:
-        for img_dir in base_path.glob('imaginize_*'):
-            if img_dir.is_dir():
-                for img_file in img_dir.glob('*.png'):
-                    images.append(str(img_file))
-
-    def sort_key(path):
-        filename = Path(path).stem
-        match = re.search(r'chapter_(\d+)_scene_(\d+)', filename)
-        if match:
-            return (int(match.group(1)), int(match.group(2)))
-        return (999, 999)
-
-    images.sort(key=sort_key)
-    return images
-
-def load_scene_descriptions(imaginize_dir):
-    """Load scene descriptions from Chapters.md file."""
-    descriptions = {}
-    chapters_file = Path(imaginize_dir) / 'Chapters.md'
-
-    if not chapters_file.exists():
-        return descriptions
-
-    try:
-        with open(chapters_file, 'r', encoding='utf-8') as f:
-            content = f.read()
-
-        lines = content.split('\n')
-        i = 0
-        current_desc = ''
-
-        while i < len(lines):
-            line = lines[i].strip()
-
-            if '**Visual Elements:**' in line:
-                desc_line = line.split('**Visual Elements:**', 1)[1].strip()
-                full_desc = desc_line
-                k = i + 1
-                while k < len(lines) and lines[k].strip() and not lines[k].startswith('**'):
-                    full_desc += ' ' + lines[k].strip()
-                    k += 1
-
-                # Look for the FIRST image reference only
-                for j in range(i, min(i+15, len(lines))):
-                    if 'chapter_' in lines[j] and '_scene_' in lines[j]:
-                        match = re.search(r'chapter_(\d+)_scene_(\d+)', lines[j])
-                        if match:
-                            descriptions[(match.group(1), match.group(2))] = full_desc.strip()
-                        break
-            i += 1
-
-    except Exception as e:
-        print(f"⚠️  Warning: Could not parse Chapters.md: {e}")
-
-    return descriptions
-
-def extract_smart_caption(desc):
-    """Extract a concise caption (5-8 words) focusing on subject and location."""
-    if not desc:
-        return ""
-
-    words = desc.split()
-    result = []
-
-    # Words to skip entirely
-    skip = {'a', 'an', 'the', 'is', 'are', 'was', 'were', 'has', 'have', 'had',
-            'and', 'or', 'but', 'with', 'by', 'for', 'to', 'from', 'of',
-            'tall', 'short', 'out', 'shape', 'dressed', 'appearing', 'blurred',
-            'contrasting', 'standing', 'sitting', 'looking', 'like'}
-
-    # Capture first sentence only (before first period)
-    first_sentence = []
-    for w in words:
-        first_sentence.append(w)
-        if w.endswith('.'):
-            break
-
-    # Build caption from key words, preserving proper nouns
-    for word in first_sentence:
-        clean = word.rstrip(',.;:')
-        if not clean:
-            continue
 
-        # Always keep capitalized words (proper nouns) and location prepositions
-        if clean[0].isupper() or clean.lower() in ['in', 'at', 'on', 'near', 'before']:
-            result.append(clean)
-        elif clean.lower() not in skip and len(clean) > 2:
-            result.append(clean)
-
-        if len(result) >= 7:
-            break
-
-    return ' '.join(result) if result else desc[:50]
-
-def get_caption(img_path, descriptions):
-    """Get concise caption for image from descriptions."""
-    filename = Path(img_path).stem
-    match = re.search(r'chapter_(\d+)_scene_(\d+)', filename)
-    if match:
-        chapter, scene = match.group(1), match.group(2)
-        if (chapter, scene) in descriptions:
-            return extract_smart_caption(descriptions[(chapter, scene)])
-        return f"Chapter {chapter}, Scene {scene}"
-    return ""
-
-def get_font(size, bold=False):
-    """Get a font, falling back to default if custom fonts unavailable."""
+from _scene_utils import SCENE_RE, collect_images, load_scene_descriptions, get_caption
+
+try:
+    import pyvips
+except ImportError:
+    pyvips = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+CAPTION_HEIGHT = 60
+# Cover, metadata and TOC pages are flat colour and text, which lossless WebP encodes
+# several times smaller than lossy (and faster), with no ringing around the glyphs
+PAGE_WEBP_OPTIONS = {'lossless': True, 'quality': 80, 'method': 4}
+# Sidecar in the output directory recording which sources each WebP was encoded from
+CACHE_FILENAME = '.imaginize_cache.json'
+
+@lru_cache(maxsize=16)
+def get_font(size, bold=False, basic=False):
+    """Get a font, falling back to default if custom fonts unavailable.
+
+    Cached so each (size, bold) face is loaded once per process and its
+    FreeType glyph cache stays warm across pages and captions. `basic` selects
+    Pillow's basic layout engine, skipping Raqm shaping (when Pillow is built
+    with it) for text that needs no complex-script handling.
+    """
     font_paths = [
         "/system/fonts/Roboto-Bold.ttf" if bold else "/system/fonts/Roboto-Regular.ttf",
         "/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf" if bold else "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
     ]
     for font_path in font_paths:
         try:
-            return ImageFont.truetype(font_path, size)
+            return ImageFont.truetype(font_path, size,
+                                      layout_engine=ImageFont.Layout.BASIC if basic else None)
         except:
             continue
     return ImageFont.load_default()
@@ -142,7 +64,77 @@ def create_page_image(width=1024, height=1024):
     """Create a dark background image for front matter pages."""
     return Image.new('RGB', (width, height), color='#1a1a1a')
 
-def create_webp_album(images, output_path, title="Illustrated Book", author="Unknown", imaginize_dir=None, quality=95):
+@lru_cache(maxsize=4)
+def caption_bar_template(width):
+    """Blank caption bar background, built once per image width."""
+    return Image.new('RGB', (width, CAPTION_HEIGHT), color='#1a1a1a')
+
+def render_caption_bar(caption, width):
+    """Render the caption bar drawn over the bottom of each scene image."""
+    # Background comes from the per-width template; only the text varies
+    bar = caption_bar_template(width).copy()
+    draw = ImageDraw.Draw(bar)
+    caption_font = get_font(16, bold=True, basic=caption.isascii())
+    draw.text((width // 2, CAPTION_HEIGHT // 2), caption,
+             fill='#e0e0e0', font=caption_font, anchor='mm')
+    return bar
+
+def convert_to_webp_vips(img_path, webp_path, caption, quality, max_size=None, method=4, lossless=False):
+    """libvips variant of convert_to_webp; returns the WebP size, or None if the image needs Pillow."""
+    if max_size:
+        # thumbnail() shrinks while loading where the format allows it
+        img = pyvips.Image.thumbnail(img_path, max_size, height=max_size, size='down')
+    else:
+        img = pyvips.Image.new_from_file(img_path, access='sequential')
+    if img.format != 'uchar' or img.bands not in (3, 4):
+        return None
+    if img.bands == 4:
+        # Drop alpha, as Pillow's RGBA -> RGB conversion does
+        img = img[:3]
+
+    if caption:
+        bar = render_caption_bar(caption, img.width)
+        bar = pyvips.Image.new_from_memory(bar.tobytes(), bar.width, bar.height, 3, 'uchar')
+        img = img.insert(bar, 0, img.height - CAPTION_HEIGHT)
+    data = img.webpsave_buffer(Q=quality, effort=method, lossless=lossless, strip=True)
+    with open(webp_path, 'wb') as f:
+        f.write(data)
+    return len(data)
+
+def convert_to_webp(img_path, webp_path, caption, quality, max_size=None, method=4, lossless=False):
+    """Draw the caption bar onto an image and save it as WebP; returns the WebP size.
+
+    With max_size the image is first scaled down to fit in a max_size x max_size box.
+    An empty caption skips the bar, so the image is only transcoded.
+    """
+    webp_size = None
+    if pyvips is not None:
+        webp_size = convert_to_webp_vips(img_path, webp_path, caption, quality, max_size, method, lossless)
+    if webp_size is None:
+        with Image.open(img_path) as img:
+            if max_size:
+                # draft() lets JPEG sources decode at reduced scale; PNG ignores it
+                img.draft('RGB', (max_size, max_size))
+                img.thumbnail((max_size, max_size), Image.Resampling.LANCZOS)
+            if img.mode in ('RGBA', 'P'):
+                img = img.convert('RGB')
+
+            # Add caption overlay at bottom
+            if caption:
+                width, height = img.size
+                img.paste(render_caption_bar(caption, width), (0, height - CAPTION_HEIGHT))
+
+            # Encode in memory: the buffer length is the file size, with no stat() afterwards
+            buf = BytesIO()
+            img.save(buf, 'WEBP', quality=quality, method=method, lossless=lossless)
+            with open(webp_path, 'wb') as f:
+                f.write(buf.getbuffer())
+            webp_size = buf.tell()
+
+    return webp_size
+
+def create_webp_album(images, output_path, title="Illustrated Book", author="Unknown", imaginize_dir=None, quality=95,
+                      max_size=None, method=4, lossless=False, draw_captions=True):
     """
     Convert images to WebP format with caption overlays and front matter pages.
 
@@ -152,13 +144,21 @@ def create_webp_album(images, output_path, title="Illustrated Book", author="Unk
         title: Book title
         author: Author name
         imaginize_dir: Path to imaginize directory
-        quality: WebP quality (0-100), default 95
+        quality: WebP quality (0-100) for the scene images, default 95
+        max_size: Optional longest-edge limit in pixels for the scene images
+        method: WebP encoder effort (0-6) for the scene images, default 4
+        lossless: Encode the scene images losslessly; always uses the slowest,
+            smallest method 6 (front matter pages are always lossless)
+        draw_captions: Draw caption bars onto the scene images (captions are still
+            listed in the TOC and album.json)
     """
-    from datetime import datetime
-    from PIL import ImageDraw
-
     descriptions = load_scene_descriptions(imaginize_dir) if imaginize_dir else {}
 
+    # method=6 spends most of its time on rate-distortion search for output that is
+    # rarely more than a couple of percent smaller than method=4's; keep it for lossless
+    if lossless:
+        method = 6
+
     # Create output directory
     output_dir = Path(output_path)
     output_dir.mkdir(parents=True, exist_ok=True)
@@ -170,12 +170,27 @@ def create_webp_album(images, output_path, title="Illustrated Book", author="Unk
         'author': author,
         'total_images': len(images),
         'quality': quality,
-        'images': []
+        'images': [None] * len(images)
     }
 
     total_original = 0
     total_webp = 0
 
+    # Plan output names and captions up front: the TOC and the workers share them,
+    # and workers only decode, draw and encode
+    webp_names = []
+    captions = []
+    for i, img_path in enumerate(images):
+        filename = Path(img_path).stem
+        match = SCENE_RE.search(filename)
+        if match:
+            webp_names.append(f"{i+10:04d}_ch{match.group(1)}_sc{match.group(2)}.webp")
+        else:
+            webp_names.append(f"{i+10:04d}_{filename}.webp")
+        captions.append(get_caption(img_path, descriptions, default=''))
+    # Caption bars actually drawn onto the images; empty means plain transcoding
+    overlays = captions if draw_captions else [''] * len(images)
+
     # Create cover page
     cover = create_page_image()
     draw = ImageDraw.Draw(cover)
@@ -185,7 +200,7 @@ def create_webp_album(images, output_path, title="Illustrated Book", author="Unk
     draw.text((512, 500), f"by {author}", fill='#888888', font=author_font, anchor='mm')
     draw.text((512, 600), f"{len(images)} illustrations", fill='#4a9eff', font=get_font(24), anchor='mm')
     cover_path = output_dir / '0000_cover.webp'
-    cover.save(cover_path, 'WEBP', quality=quality, method=6)
+    cover.save(cover_path, 'WEBP', **PAGE_WEBP_OPTIONS)
 
     # Create metadata page
     meta = create_page_image()
@@ -197,75 +212,103 @@ def create_webp_album(images, output_path, title="Illustrated Book", author="Unk
     draw.text((512, 550), f"Generated: {datetime.now().strftime('%Y-%m-%d')}", fill='#aaaaaa', font=get_font(20), anchor='mm')
     draw.text((512, 700), "github.com/tribixbite/imaginize", fill='#4a9eff', font=get_font(16), anchor='mm')
     meta_path = output_dir / '0001_metadata.webp'
-    meta.save(meta_path, 'WEBP', quality=quality, method=6)
+    meta.save(meta_path, 'WEBP', **PAGE_WEBP_OPTIONS)
 
     # Create TOC page(s)
-    toc_font = get_font(14)
+    # ASCII captions skip Raqm shaping, the slow text path, accepting the loss of
+    # kerning and ligatures
+    toc_font = get_font(14, basic=all(caption.isascii() for caption in captions))
     items_per_page = 25
+    # Pages share one of two headers ("Table of Contents" and its "(cont.)" variant);
+    # each is drawn once into a blank page that every TOC page starts from
+    toc_headers = {}
     for page_num in range((len(images) + items_per_page - 1) // items_per_page):
-        toc = create_page_image()
+        heading = f"Table of Contents{' (cont.)' if page_num > 0 else ''}"
+        if heading not in toc_headers:
+            header = create_page_image()
+            ImageDraw.Draw(header).text((512, 50), heading, fill='#e0e0e0', font=get_font(24, bold=True), anchor='mm')
+            toc_headers[heading] = header
+        toc = toc_headers[heading].copy()
         draw = ImageDraw.Draw(toc)
-        draw.text((512, 50), f"Table of Contents{' (cont.)' if page_num > 0 else ''}", fill='#e0e0e0', font=get_font(24, bold=True), anchor='mm')
 
         start_idx = page_num * items_per_page
         end_idx = min(start_idx + items_per_page, len(images))
         y = 120
         for i in range(start_idx, end_idx):
-            caption = get_caption(images[i], descriptions)
-            draw.text((50, y), f"{i+1}. {caption}", fill='#aaaaaa', font=toc_font, anchor='lm')
+            draw.text((50, y), f"{i+1}. {captions[i]}", fill='#aaaaaa', font=toc_font, anchor='lm')
             y += 35
 
         toc_path = output_dir / f'000{2 + page_num}_toc.webp'
-        toc.save(toc_path, 'WEBP', quality=quality, method=6)
+        toc.save(toc_path, 'WEBP', **PAGE_WEBP_OPTIONS)
 
-    # Convert images with caption overlays
+    # Images whose source file and encoding settings match the previous run are not
+    # re-encoded; the cache maps each source fingerprint to the WebP written for it
+    cache_path = output_dir / CACHE_FILENAME
+    try:
+        with open(cache_path, encoding='utf-8') as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        cache = {}
+
+    new_cache = {}
+    original_sizes = [None] * len(images)
+    webp_sizes = [None] * len(images)
+    pending = []
     for i, img_path in enumerate(images):
-        filename = Path(img_path).stem
-        match = re.search(r'chapter_(\d+)_scene_(\d+)', filename)
-        if match:
-            webp_name = f"{i+10:04d}_ch{match.group(1)}_sc{match.group(2)}.webp"
-        else:
-            webp_name = f"{i+10:04d}_{filename}.webp"
-
-        webp_path = output_dir / webp_name
-
-        # Open and add caption overlay
-        with Image.open(img_path) as img:
-            if img.mode in ('RGBA', 'P'):
-                img = img.convert('RGB')
-
-            width, height = img.size
-            draw = ImageDraw.Draw(img)
-
-            # Add caption overlay at bottom
-            caption = get_caption(img_path, descriptions)
-            caption_height = 60
-            draw.rectangle([0, height - caption_height, width, height], fill='#1a1a1aCC')
-            caption_font = get_font(16, bold=True)
-            draw.text((width // 2, height - caption_height // 2), caption,
-                     fill='#e0e0e0', font=caption_font, anchor='mm')
-
-            img.save(webp_path, 'WEBP', quality=quality, method=6)
-
-        original_size = Path(img_path).stat().st_size
-        webp_size = webp_path.stat().st_size
+        stat = os.stat(img_path)
+        original_sizes[i] = stat.st_size
+        key = (f"{img_path}|{stat.st_mtime_ns}|{stat.st_size}|{quality}|{method}|{lossless}"
+               f"|{max_size}|{overlays[i]}")
+        new_cache[key] = webp_names[i]
+        if cache.get(key) == webp_names[i]:
+            try:
+                webp_sizes[i] = os.stat(output_dir / webp_names[i]).st_size
+                continue
+            except OSError:
+                pass
+        pending.append(i)
+
+    if len(pending) < len(images):
+        print(f"   Reusing {len(images) - len(pending)} unchanged images")
+
+    # Convert images with caption overlays; WebP encoding is CPU-bound and each
+    # image is independent, so spread it across processes. map() yields results in order.
+    with ProcessPoolExecutor(max_workers=os.cpu_count()) as executor:
+        results = executor.map(convert_to_webp, [images[i] for i in pending],
+                               [str(output_dir / webp_names[i]) for i in pending],
+                               [overlays[i] for i in pending], [quality] * len(pending),
+                               [max_size] * len(pending), [method] * len(pending),
+                               [lossless] * len(pending), chunksize=4)
+
+        for done, (i, result) in enumerate(zip(pending, results), 1):
+            webp_sizes[i] = result
+
+            if done % 10 == 0:
+                print(f"   Converted {done}/{len(pending)} images...")
+
+    for i, (original_size, webp_size) in enumerate(zip(original_sizes, webp_sizes)):
         total_original += original_size
         total_webp += webp_size
 
-        metadata['images'].append({
-            'filename': webp_name,
-            'caption': caption,
+        metadata['images'][i] = {
+            'filename': webp_names[i],
+            'caption': captions[i],
             'original_size': original_size,
             'webp_size': webp_size
-        })
+        }
 
-        if (i + 1) % 10 == 0:
-            print(f"   Converted {i + 1}/{len(images)} images...")
+    with open(cache_path, 'w', encoding='utf-8') as f:
+        json.dump(new_cache, f, indent=2)
 
     # Save metadata
     metadata_path = output_dir / 'album.json'
-    with open(metadata_path, 'w', encoding='utf-8') as f:
-        json.dump(metadata, f, indent=2)
+    if orjson is not None:
+        # orjson encodes in C straight to UTF-8 bytes
+        with open(metadata_path, 'wb') as f:
+            f.write(orjson.dumps(metadata, option=orjson.OPT_INDENT_2))
+    else:
+        with open(metadata_path, 'w', encoding='utf-8') as f:
+            json.dump(metadata, f, indent=2)
 
     # Calculate savings
     savings = (1 - total_webp / total_original) * 100 if total_original > 0 else 0
@@ -285,6 +328,14 @@ if __name__ == "__main__":
     parser.add_argument('--title', default='Illustrated Book', help='Book title')
     parser.add_argument('--author', default='Unknown', help='Book author')
     parser.add_argument('--quality', type=int, default=85, help='WebP quality (0-100)')
+    parser.add_argument('--max-size', type=int, default=None,
+                        help='Scale scene images down to fit within this many pixels')
+    parser.add_argument('--method', type=int, default=4, choices=range(7), metavar='0-6',
+                        help='WebP encoder effort: higher is slower and slightly smaller (default 4)')
+    parser.add_argument('--lossless', action='store_true',
+                        help='Encode losslessly for archival copies (uses method 6)')
+    parser.add_argument('--no-caption', action='store_true',
+                        help='Do not draw caption bars onto the images')
 
     args = parser.parse_args()
 
@@ -301,4 +352,5 @@ if __name__ == "__main__":
 
     print(f"📸 Found {len(images)} images")
     create_webp_album(images, args.output_dir, title=args.title, author=args.author,
-                      imaginize_dir=imaginize_dir, quality=args.quality)
+                      imaginize_dir=imaginize_dir, quality=args.quality, max_size=args.max_size,
+                      method=args.method, lossless=args.lossless, draw_captions=not args.no_caption)
@@ -7,117 +7,17 @@ Perfect for web sharing and social media.
 import os
 import sys
 import json
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from pathlib import Path
-from PIL import Image, ImageDraw, ImageFont
-import re
+from PIL import Image, ImageColor, ImageDraw, ImageFont
 
-def collect_images(base_dir):
-    """Collect all PNG images sorted by chapter and scene."""
-    images = []
-    base_path = Path(base_dir)
-
-    if base_path.name.startswith('imaginize_'):
-        for img_file in base_path.glob('*.png'):
-            images.append(str(img_file))
-    else:
-        for img_dir in base_path.glob('imaginize_*'):
-            if img_dir.is_dir():
-                for img_file in img_dir.glob('*.png'):
-                    images.append(str(img_file))
-
-    def sort_key(path):
-        filename = Path(path).stem
-        match = re.search(r'chapter_(\d+)_scene_(\d+)', filename)
-        if match:
-            return (int(match.group(1)), int(match.group(2)))
-        return (999, 999)
-
-    images.sort(key=sort_key)
-    return images
-
-def load_scene_descriptions(imaginize_dir):
-    """Load scene descriptions from Chapters.md file."""
-    descriptions = {}
-    chapters_file = Path(imaginize_dir) / 'Chapters.md'
-
-    if not chapters_file.exists():
-        return descriptions
-
-    try:
-        with open(chapters_file, 'r', encoding='utf-8') as f:
-            content = f.read()
-
-        lines = content.split('\n')
-        i = 0
-        current_desc = ''
-
-        while i < len(lines):
-            line = lines[i].strip()
-
-            if '**Visual Elements:**' in line:
-                desc_line = line.split('**Visual Elements:**', 1)[1].strip()
-                full_desc = desc_line
-                k = i + 1
-                while k < len(lines) and lines[k].strip() and not lines[k].startswith('**'):
-                    full_desc += ' ' + lines[k].strip()
-                    k += 1
-
-                # Look for the FIRST image reference only
-                for j in range(i, min(i+15, len(lines))):
-                    if 'chapter_' in lines[j] and '_scene_' in lines[j]:
-                        match = re.search(r'chapter_(\d+)_scene_(\d+)', lines[j])
-                        if match:
-                            descriptions[(match.group(1), match.group(2))] = full_desc.strip()
-                        break
-            i += 1
-
-    except Exception as e:
-        print(f"⚠️  Warning: Could not parse Chapters.md: {e}")
-
-    return descriptions
-
-def extract_smart_caption(desc):
-    """Extract a concise caption (5-8 words) focusing on subject and location."""
-    if not desc:
-        return ""
-
-    words = desc.split()
-    result = []
-
-    # Words to skip entirely
-    skip = {'a', 'an', 'the', 'is', 'are', 'was', 'were', 'has', 'have', 'had',
-            'and', 'or', 'but', 'with', 'by', 'for', 'to', 'from', 'of',
-            'tall', 'short', 'out', 'shape', 'dressed', 'appearing', 'blurred',
-            'contrasting', 'standing', 'sitting', 'looking', 'like'}
-
-    # Capture first sentence only (before first period)
-    first_sentence = []
-    for w in words:
-        first_sentence.append(w)
-        if w.endswith('.'):
-            break
-
-    # Build caption from key words, preserving proper nouns
-    for word in first_sentence:
-        clean = word.rstrip(',.;:')
-        if not clean:
-            continue
-
-        # Always keep capitalized words (proper nouns) and location prepositions
-        if clean[0].isupper() or clean.lower() in ['in', 'at', 'on', 'near', 'before']:
-            result.append(clean)
-        elif clean.lower() not in skip and len(clean) > 2:
-            result.append(clean)
-
-        if len(result) >= 7:
-            break
-
-    return ' '.join(result) if result else desc[:50]
+from _scene_utils import SCENE_RE, collect_images, load_scene_descriptions, extract_smart_caption, read_image_size
 
 def get_caption(img_path, descriptions):
     """Get concise caption for image from descriptions."""
     filename = Path(img_path).stem
-    match = re.search(r'chapter_(\d+)_scene_(\d+)', filename)
+    match = SCENE_RE.search(filename)
     if match:
         chapter, scene = match.group(1), match.group(2)
         if (chapter, scene) in descriptions:
@@ -126,8 +26,15 @@ def get_caption(img_path, descriptions):
         return f"Chapter {chapter}, Scene {scene}"
     return Path(img_path).stem
 
-def get_font(size, bold=False):
-    """Get a font, falling back to default if custom fonts unavailable."""
+@lru_cache(maxsize=16)
+def get_font(size, bold=False, basic=False):
+    """Get a font, falling back to default if custom fonts unavailable.
+
+    Cached so each (size, bold) face is loaded once per process and its
+    FreeType glyph cache stays warm across pages and captions. `basic` selects
+    Pillow's basic layout engine, skipping Raqm shaping (when Pillow is built
+    with it) for text that needs no complex-script handling.
+    """
     font_paths = [
         "/system/fonts/Roboto-Bold.ttf" if bold else "/system/fonts/Roboto-Regular.ttf",
         "/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf" if bold else "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
@@ -136,13 +43,32 @@ def get_font(size, bold=False):
 
     for font_path in font_paths:
         try:
-            return ImageFont.truetype(font_path, size)
+            return ImageFont.truetype(font_path, size,
+                                      layout_engine=ImageFont.Layout.BASIC if basic else None)
         except:
             continue
 
     return ImageFont.load_default()
 
-def create_webp_strip(images, output_path, title="Illustrated Book", author="Unknown", imaginize_dir=None, quality=85):
+def load_scaled_image(img_path, strip_width):
+    """Open an image as RGB, scaled to the strip width."""
+    with Image.open(img_path) as img:
+        # Convert to RGB if necessary
+        if img.mode in ('RGBA', 'P'):
+            img = img.convert('RGB')
+
+        # DALL-E renders are already strip-wide; only other sizes need resampling
+        if img.width == strip_width:
+            img.load()
+            return img
+
+        # Scale to strip width; reducing_gap lets large downscales shrink with a cheap
+        # box reduce first, so the Lanczos pass runs over far fewer source pixels
+        scale = strip_width / img.width
+        new_height = int(img.height * scale)
+        return img.resize((strip_width, new_height), Image.Resampling.LANCZOS, reducing_gap=3.0)
+
+def create_webp_strip(images, output_path, title="Illustrated Book", author="Unknown", imaginize_dir=None, quality=95):
     """
     Create vertical WebP strip(s) with all images and metadata.
     Splits into multiple files if total height exceeds WebP limit.
@@ -156,6 +82,10 @@ def create_webp_strip(images, output_path, title="Illustrated Book", author="Unk
         quality: WebP quality (0-100)
     """
     descriptions = load_scene_descriptions(imaginize_dir) if imaginize_dir else {}
+    # Each caption appears in the TOC and under its image; compute it once
+    captions = {img_path: get_caption(img_path, descriptions) for img_path in images}
+    # Layout only needs image dimensions, read from the PNG headers without decoding
+    sizes = {img_path: read_image_size(img_path) for img_path in images}
 
     print(f"🎞️  Creating WebP strip with {len(images)} images...")
 
@@ -178,11 +108,10 @@ def create_webp_strip(images, output_path, title="Illustrated Book", author="Unk
     total_height += toc_height + spacing  # TOC section
 
     for img_path in images:
-        with Image.open(img_path) as img:
-            # Scale image to strip width
-            scale = strip_width / img.width
-            img_height = int(img.height * scale)
-            total_height += img_height + caption_height + spacing
+        # Scale image to strip width
+        width, height = sizes[img_path]
+        img_height = int(height * (strip_width / width))
+        total_height += img_height + caption_height + spacing
 
     total_height += 100  # Footer
 
@@ -230,7 +159,7 @@ def create_webp_strip(images, output_path, title="Illustrated Book", author="Unk
             strip_title = f"{title} (Part {strip_idx + 1}/{num_strips})"
 
             _create_single_strip(strip_images, str(strip_path), strip_title, author,
-                               descriptions, strip_width, header_height, caption_height,
+                               captions, sizes, strip_width, header_height, caption_height,
                                spacing, bg_color, text_color, accent_color, quality,
                                include_toc=(strip_idx == 0), toc_images=images if strip_idx == 0 else None)
 
@@ -250,13 +179,13 @@ def create_webp_strip(images, output_path, title="Illustrated Book", author="Unk
         return
 
     # Single strip
-    _create_single_strip(images, output_path, title, author, descriptions,
+    _create_single_strip(images, output_path, title, author, captions, sizes,
                         strip_width, header_height, caption_height, spacing,
                         bg_color, text_color, accent_color, quality,
                         include_toc=True, toc_images=images)
 
 
-def _create_single_strip(images, output_path, title, author, descriptions,
+def _create_single_strip(images, output_path, title, author, captions, sizes,
                          strip_width, header_height, caption_height, spacing,
                          bg_color, text_color, accent_color, quality,
                          include_toc=True, toc_images=None):
@@ -275,10 +204,9 @@ def _create_single_strip(images, output_path, title, author, descriptions,
         total_height += toc_height + spacing
 
     for img_path in images:
-        with Image.open(img_path) as img:
-            scale = strip_width / img.width
-            img_height = int(img.height * scale)
-            total_height += img_height + caption_height + spacing
+        width, height = sizes[img_path]
+        img_height = int(height * (strip_width / width))
+        total_height += img_height + caption_height + spacing
 
     total_height += 100  # Footer
 
@@ -289,9 +217,14 @@ def _create_single_strip(images, output_path, title, author, descriptions,
     # Fonts
     title_font = get_font(48, bold=True)
     subtitle_font = get_font(24)
-    caption_font = get_font(18, bold=True)
-    toc_font = get_font(16)
+    # ASCII captions and TOC entries skip Raqm shaping, the slow text path, accepting
+    # the loss of kerning and ligatures; titles keep full shaping for complex scripts
+    basic = all(caption.isascii() for caption in captions.values())
+    caption_font = get_font(18, bold=True, basic=basic)
+    toc_font = get_font(16, basic=basic)
     footer_font = get_font(14)
+    # Caption band colour, parsed once for every image
+    caption_bg = ImageColor.getrgb('#2a2a2a')
 
     y_pos = spacing
 
@@ -311,34 +244,28 @@ def _create_single_strip(images, output_path, title, author, descriptions,
 
         toc_y = y_pos + 70
         for i, img_path in enumerate(toc_images):
-            caption = get_caption(img_path, descriptions)
-            draw.text((50, toc_y), f"{i+1}. {caption}", fill='#aaaaaa', font=toc_font, anchor='lm')
+            draw.text((50, toc_y), f"{i+1}. {captions[img_path]}", fill='#aaaaaa', font=toc_font, anchor='lm')
             toc_y += toc_item_height
 
         y_pos += toc_height + spacing
 
     # === Images with Captions ===
-    for i, img_path in enumerate(images):
-        with Image.open(img_path) as img:
-            # Convert to RGB if necessary
-            if img.mode in ('RGBA', 'P'):
-                img = img.convert('RGB')
-
-            # Scale to strip width
-            scale = strip_width / img.width
-            new_height = int(img.height * scale)
-            img_resized = img.resize((strip_width, new_height), Image.Resampling.LANCZOS)
+    # PNG decoding and resizing run in Pillow's C code with the GIL released, so a
+    # thread pool overlaps them across images; pasting and drawing stay here, in order
+    with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+        scaled_images = executor.map(load_scaled_image, images, [strip_width] * len(images))
 
+        for img_path, img_resized in zip(images, scaled_images):
             # Paste image
             strip.paste(img_resized, (0, y_pos))
-            y_pos += new_height
+            y_pos += img_resized.height
 
-            # Draw caption background
-            draw.rectangle([0, y_pos, strip_width, y_pos + caption_height], fill='#2a2a2a')
+            # Caption background: a plain fill of the band, no shape rasterizing;
+            # the extra row matches the inclusive bottom edge the band has always had
+            strip.paste(caption_bg, (0, y_pos, strip_width, y_pos + caption_height + 1))
 
             # Draw caption text
-            caption = get_caption(img_path, descriptions)
-            draw.text((strip_width // 2, y_pos + caption_height // 2), caption,
+            draw.text((strip_width // 2, y_pos + caption_height // 2), captions[img_path],
                      fill=text_color, font=caption_font, anchor='mm')
 
             y_pos += caption_height + spacing
@@ -347,8 +274,8 @@ def _create_single_strip(images, output_path, title, author, descriptions,
     draw.text((strip_width // 2, y_pos + 30), "Generated by imaginize", fill='#666666', font=footer_font, anchor='mm')
     draw.text((strip_width // 2, y_pos + 55), "github.com/tribixbite/imaginize", fill=accent_color, font=footer_font, anchor='mm')
 
-    # Save as WebP with high quality
-    strip.save(output_path, 'WEBP', quality=95, method=6)
+    # The strip is mostly photographic, so it stays lossy at the requested quality
+    strip.save(output_path, 'WEBP', quality=quality, method=6)
 
     size_mb = Path(output_path).stat().st_size / (1024 * 1024)
     print(f"   Created: {output_path} ({size_mb:.1f} MB, {strip_width}x{total_height}px)")
@@ -361,7 +288,7 @@ if __name__ == "__main__":
     parser.add_argument('output_file', help='Output WebP filename')
     parser.add_argument('--title', default='Illustrated Book', help='Book title')
     parser.add_argument('--author', default='Unknown', help='Book author')
-    parser.add_argument('--quality', type=int, default=85, help='WebP quality (0-100)')
+    parser.add_argument('--quality', type=int, default=95, help='WebP quality (0-100)')
 
     args = parser.parse_args()
 
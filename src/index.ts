@@ -1109,7 +1109,7 @@ export async function main(): Promise<void> {
             console.error(chalk.yellow(`   ${error.message || error}`));
             console.error(
               chalk.yellow(
-                '   Please ensure Python 3 and required packages (Pillow, reportlab, qrcode, openai) are installed.'
+                '   Please ensure Python 3 and required packages (Pillow, reportlab, openai) are installed.'
               )
             );
           }